@@ -1,8 +1,7 @@
 import torch
 import torch.nn as nn
 from utils.signal_helpers import N_CHANNELS
-import torch.nn.functional as F
-from torch.nn.utils import spectral_norm
+from torch.nn.utils.parametrizations import spectral_norm
 
 # Constants
 BATCH_SIZE = 16
@@ -31,8 +30,9 @@ class LinearAttention(nn.Module):
         key = self.key(x).view(batch, -1, height * width).permute(0, 2, 1)
         value = self.value(x).view(batch, -1, height * width)
 
-        attention = torch.bmm(key, query)
-        attention = F.normalize(F.relu(attention), p=1, dim=1)
+        # ReLU in place on the (N, N) energy buffer; after it the L1 norm is a plain sum
+        attention = torch.bmm(key, query).relu_()
+        attention = attention / attention.sum(dim=1, keepdim=True).clamp_min(1e-12)
 
         out = torch.bmm(value, attention)
         out = out.view(batch, channels, height, width)
@@ -88,7 +88,6 @@ class Critic(nn.Module):
             nn.LeakyReLU(0.2),
             nn.BatchNorm2d(16),
             nn.Dropout(DROPOUT_RATE),
-            LinearAttention(16),
             spectral_norm(nn.Conv2d(16, 32, kernel_size=4, stride=2, padding=1)),
             nn.LeakyReLU(0.2),
             nn.BatchNorm2d(32),
@@ -97,10 +96,12 @@ class Critic(nn.Module):
             nn.LeakyReLU(0.2),
             nn.BatchNorm2d(64),
             nn.Dropout(DROPOUT_RATE),
+            LinearAttention(64),  # 8x8
             spectral_norm(nn.Conv2d(64, 128, kernel_size=4, stride=2, padding=1)),
             nn.LeakyReLU(0.2),
             nn.BatchNorm2d(128),
             nn.Dropout(DROPOUT_RATE),
+            LinearAttention(128),  # 4x4
             spectral_norm(nn.Conv2d(128, 1, kernel_size=4, stride=1, padding=0)),
             nn.Flatten(),
         )
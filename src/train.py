@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 import torch
 from architecture import LATENT_DIM, Critic, Generator
 import numpy as np
@@ -44,12 +45,14 @@ def compute_c_loss(
     real_audio_data,
     training,
     device,
+    scaler,
 ):
     wasserstein_dist = compute_wasserstein_diff(real_validity, fake_validity)
-    spectral_diff = 0.15 * calculate_spectral_diff(real_audio_data, fake_audio_data)
-    spectral_convergence = 0.15 * calculate_spectral_convergence_diff(
+    spectral_diff, spectral_convergence = calculate_spectral_diffs(
         real_audio_data, fake_audio_data
     )
+    spectral_diff = 0.15 * spectral_diff
+    spectral_convergence = 0.15 * spectral_convergence
 
     computed_c_loss = (
         # discrim total loss
@@ -60,7 +63,7 @@ def compute_c_loss(
 
     if training:
         gradient_penalty = calculate_gradient_penalty(
-            critic, real_audio_data, fake_audio_data, device
+            critic, real_audio_data, fake_audio_data, device, scaler
         )
         computed_c_loss += LAMBDA_GP * gradient_penalty
 
@@ -83,40 +86,50 @@ def calculate_feature_match_diff(critic, real_audio_data, fake_audio_data):
     return loss / len(real_features)
 
 
-def calculate_spectral_diff(real_audio_data, fake_audio_data):
-    return torch.mean(torch.abs(real_audio_data - fake_audio_data))
+def calculate_spectral_diffs(real_audio_data, fake_audio_data):
+    # Spectral L1 diff and spectral convergence share one difference tensor
+    diff = real_audio_data - fake_audio_data
+    spectral_diff = diff.abs().mean()
 
+    numerator = torch.linalg.vector_norm(diff)
+    denominator = torch.linalg.vector_norm(real_audio_data) + 1e-8
+    spectral_convergence = numerator / denominator
 
-def calculate_spectral_convergence_diff(real_audio_data, fake_audio_data):
-    numerator = torch.norm(fake_audio_data - real_audio_data, p=2)
-    denominator = torch.norm(real_audio_data, p=2) + 1e-8
-    return numerator / denominator
+    return spectral_diff, spectral_convergence
 
 
-def calculate_gradient_penalty(critic, real_samples, fake_samples, device):
-    real_samples.requires_grad_(True)
-    fake_samples.requires_grad_(True)
-
-    alpha = torch.rand(real_samples.size(0), 1, 1, 1).to(device)
+def calculate_gradient_penalty(critic, real_samples, fake_samples, device, scaler):
+    alpha = torch.rand(real_samples.size(0), 1, 1, 1, device=device)
     interpolates = (alpha * real_samples + (1 - alpha) * fake_samples).requires_grad_(
         True
     )
-    c_interpolates = critic(interpolates)
-    fake = torch.ones(real_samples.size(0), 1).to(device)
+    c_interpolates = critic(interpolates).float()
+
+    # Like the AMP recipe, scale a reduced fp32 output rather than each score:
+    # a per-score grad of the full scale (65536) overflows fp16 in the critic.
+    # The mean's grad is scale / batch per score, so multiply back by batch
+    batch = c_interpolates.size(0)
+    scaled_c_interpolates = scaler.scale(c_interpolates.mean())
     gradients = torch.autograd.grad(
-        outputs=c_interpolates,
+        outputs=scaled_c_interpolates,
         inputs=interpolates,
-        grad_outputs=fake,
         create_graph=True,
-        retain_graph=True,
         only_inputs=True,
     )[0]
-    gradients = gradients.view(gradients.size(0), -1)
+    # Unscale with the on-device scale tensor, get_scale() would sync the host
+    scale = scaler.scale(torch.ones((), device=device))
+    gradients = gradients * (batch / scale)
+    gradients = gradients.reshape(gradients.size(0), -1)
     gradient_penalty = ((gradients.norm(2, dim=1) - 1) ** 2).mean()
     return gradient_penalty
 
 
 # Training
+def get_memory_format(device):
+    # NHWC conv kernels only pay off with cuDNN on CUDA
+    return torch.channels_last if device.type == "cuda" else torch.contiguous_format
+
+
 def train_epoch(
     generator,
     critic,
@@ -125,52 +138,74 @@ def train_epoch(
     optimizer_C,
     scheduler_G,
     scheduler_C,
+    scaler_G,
+    scaler_C,
     device,
     epoch_number,
 ):
     generator.train()
     critic.train()
-    total_g_loss, total_c_loss, total_w_dist = 0, 0, 0
+    use_amp = device.type == "cuda"
+    # Accumulate on device, syncing once per epoch instead of every batch
+    total_g_loss = torch.zeros((), device=device)
+    total_c_loss = torch.zeros((), device=device)
+    total_w_dist = torch.zeros((), device=device)
+    memory_format = get_memory_format(device)
+    z_buffer = torch.empty(0, LATENT_DIM, 1, 1, device=device)
 
     for i, (real_audio_data,) in enumerate(dataloader):
         batch = real_audio_data.size(0)
-        real_audio_data = real_audio_data.to(device)
-
-        # Train critic
-        optimizer_C.zero_grad()
-        z = torch.randn(batch, LATENT_DIM, 1, 1).to(device)
-        fake_audio_data = generator(z)
-        real_validity = critic(real_audio_data)
-        fake_validity = critic(fake_audio_data.detach())
-
-        c_loss = compute_c_loss(
-            critic,
-            fake_validity,
-            real_validity,
-            fake_audio_data,
-            real_audio_data,
-            True,
-            device,
+        real_audio_data = real_audio_data.to(
+            device, memory_format=memory_format, non_blocking=True
         )
-        c_loss.backward()
-        optimizer_C.step()
 
-        total_c_loss += c_loss.item()
-        total_w_dist += compute_wasserstein_diff(real_validity, fake_validity).item()
+        train_generator = i % CRITIC_STEPS == 0
 
-        # Train generator every CRITIC_STEPS steps
-        if i % CRITIC_STEPS == 0:
-            optimizer_G.zero_grad()
-            fake_audio_data = generator(z)
-            fake_validity = critic(fake_audio_data)
+        # Train critic
+        optimizer_C.zero_grad(set_to_none=True)
+        # Grow the latent buffer to the loader's batch size, then refill in place
+        if batch > z_buffer.size(0):
+            z_buffer = torch.empty(batch, LATENT_DIM, 1, 1, device=device)
+        z = z_buffer[:batch].normal_()
+        with torch.autocast(device.type, dtype=torch.float16, enabled=use_amp):
+            # Only keep the generator graph when this batch also trains it
+            with torch.set_grad_enabled(train_generator):
+                fake_audio_data = generator(z)
+            detached_fake_audio_data = fake_audio_data.detach()
+            real_validity = critic(real_audio_data)
+            fake_validity = critic(detached_fake_audio_data)
 
-            g_loss = compute_g_loss(
-                critic, fake_validity, fake_audio_data, real_audio_data
+            c_loss = compute_c_loss(
+                critic,
+                fake_validity,
+                real_validity,
+                detached_fake_audio_data,
+                real_audio_data,
+                True,
+                device,
+                scaler_C,
             )
-            g_loss.backward()
-            optimizer_G.step()
+        scaler_C.scale(c_loss).backward()
+        scaler_C.step(optimizer_C)
+        scaler_C.update()
+
+        total_c_loss += c_loss.detach()
+        total_w_dist += compute_wasserstein_diff(real_validity, fake_validity).detach()
 
-            total_g_loss += g_loss.item()
+        # Train generator every CRITIC_STEPS steps, reusing the critic step's batch
+        if train_generator:
+            optimizer_G.zero_grad(set_to_none=True)
+            with torch.autocast(device.type, dtype=torch.float16, enabled=use_amp):
+                fake_validity = critic(fake_audio_data)
+
+                g_loss = compute_g_loss(
+                    critic, fake_validity, fake_audio_data, real_audio_data
+                )
+            scaler_G.scale(g_loss).backward()
+            scaler_G.step(optimizer_G)
+            scaler_G.update()
+
+            total_g_loss += g_loss.detach()
 
             # # Save training progress images
             # if i % (CRITIC_STEPS * 14) == 0:
@@ -181,9 +216,9 @@ def train_epoch(
             #         True,
             #     )
 
-    avg_g_loss = total_g_loss / len(dataloader)
-    avg_c_loss = total_c_loss / len(dataloader)
-    avg_w_dist = total_w_dist / len(dataloader)
+    avg_g_loss = (total_g_loss / len(dataloader)).item()
+    avg_c_loss = (total_c_loss / len(dataloader)).item()
+    avg_w_dist = (total_w_dist / len(dataloader)).item()
 
     scheduler_G.step()
     scheduler_C.step()
@@ -194,14 +229,23 @@ def train_epoch(
 def validate(generator, critic, dataloader, device):
     generator.eval()
     critic.eval()
-    total_g_loss, total_c_loss, total_w_dist = 0, 0, 0
-
-    with torch.no_grad():
+    use_amp = device.type == "cuda"
+    memory_format = get_memory_format(device)
+    # Accumulate on device, syncing once per epoch instead of every batch
+    total_g_loss = torch.zeros((), device=device)
+    total_c_loss = torch.zeros((), device=device)
+    total_w_dist = torch.zeros((), device=device)
+
+    with torch.inference_mode(), torch.autocast(
+        device.type, dtype=torch.float16, enabled=use_amp
+    ):
         for (real_audio_data,) in dataloader:
             batch = real_audio_data.size(0)
-            real_audio_data = real_audio_data.to(device)
+            real_audio_data = real_audio_data.to(
+                device, memory_format=memory_format, non_blocking=True
+            )
 
-            z = torch.randn(batch, LATENT_DIM, 1, 1).to(device)
+            z = torch.randn(batch, LATENT_DIM, 1, 1, device=device)
             fake_audio_data = generator(z)
 
             real_validity = critic(real_audio_data)
@@ -218,22 +262,26 @@ def validate(generator, critic, dataloader, device):
                 real_audio_data,
                 False,
                 device,
+                None,
             )
 
-            total_g_loss += g_loss.item()
-            total_c_loss += c_loss.item()
-            total_w_dist += compute_wasserstein_diff(
-                real_validity, fake_validity
-            ).item()
+            total_g_loss += g_loss
+            total_c_loss += c_loss
+            total_w_dist += compute_wasserstein_diff(real_validity, fake_validity)
 
     return (
-        total_g_loss / len(dataloader),
-        total_c_loss / len(dataloader),
-        total_w_dist / len(dataloader),
+        (total_g_loss / len(dataloader)).item(),
+        (total_c_loss / len(dataloader)).item(),
+        (total_w_dist / len(dataloader)).item(),
     )
 
 
 def training_loop(train_loader, val_loader):
+    # Fixed input shapes, let cuDNN autotune and allow TF32 on Ampere+
+    torch.backends.cudnn.benchmark = True
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
+
     # Initialize models and optimizers
     generator = Generator()
     critic = Critic()
@@ -246,60 +294,87 @@ def training_loop(train_loader, val_loader):
 
     # Train
     device = get_device()
-    generator.to(device)
-    critic.to(device)
+    generator.to(device, memory_format=get_memory_format(device))
+    critic.to(device, memory_format=get_memory_format(device))
+
+    # Mixed precision (no-op off CUDA)
+    use_amp = device.type == "cuda"
+    scaler_G = torch.amp.GradScaler(device.type, enabled=use_amp)
+    scaler_C = torch.amp.GradScaler(device.type, enabled=use_amp)
+
+    # Compile generator for fused conv/bn/activation kernels. Critic stays eager:
+    # the gradient penalty double backward isn't supported by compiled graphs
+    compiled_generator = generator
+    if device.type == "cuda":
+        compiled_generator = torch.compile(generator)
 
     best_val_w_dist = float("inf")  # Initialize
     epochs_no_improve = 0
     patience = 3  # epochs
     warmup = 4  # epochs
-    for epoch in range(N_EPOCHS):
-        # Train
-        train_g_loss, train_c_loss, train_w_dist = train_epoch(
-            generator,
-            critic,
-            train_loader,
-            optimizer_G,
-            optimizer_C,
-            scheduler_G,
-            scheduler_C,
-            device,
-            epoch,
-        )
-        print(
-            f"[{epoch+1}/{N_EPOCHS}] Train - G Loss: {train_g_loss:.6f}, C Loss: {train_c_loss:.6f}, W Dist: {train_w_dist:.6f}"
-        )
 
-        # Validate
-        val_g_loss, val_c_loss, val_w_dist = validate(
-            generator, critic, val_loader, device
-        )
-        print(
-            f"------ Val ------ G Loss: {val_g_loss:.6f}, C Loss: {val_c_loss:.6f}, W Dist: {val_w_dist:.6f}"
-        )
+    # Plot example spectrograms off the training thread
+    plot_futures = []
+    with ThreadPoolExecutor(max_workers=1) as plot_executor:
+        for epoch in range(N_EPOCHS):
+            # Train
+            train_g_loss, train_c_loss, train_w_dist = train_epoch(
+                compiled_generator,
+                critic,
+                train_loader,
+                optimizer_G,
+                optimizer_C,
+                scheduler_G,
+                scheduler_C,
+                scaler_G,
+                scaler_C,
+                device,
+                epoch,
+            )
+            print(
+                f"[{epoch+1}/{N_EPOCHS}] Train - G Loss: {train_g_loss:.6f}, C Loss: {train_c_loss:.6f}, W Dist: {train_w_dist:.6f}"
+            )
 
-        # Generate example audio
-        if (epoch + 1) % SHOW_GENERATED_INTERVAL == 0:
-            examples_to_generate = 3
-            z = torch.randn(examples_to_generate, LATENT_DIM, 1, 1).to(device)
-            generated_audio = generator(z).squeeze()
-
-            for i in range(examples_to_generate):
-                generated_audio_np = generated_audio[i].cpu().detach().numpy()
-                graph_spectrogram(
-                    generated_audio_np,
-                    f"Epoch {epoch + 1} Generated Audio #{i + 1}",
-                )
+            # Validate
+            val_g_loss, val_c_loss, val_w_dist = validate(
+                generator, critic, val_loader, device
+            )
+            print(
+                f"------ Val ------ G Loss: {val_g_loss:.6f}, C Loss: {val_c_loss:.6f}, W Dist: {val_w_dist:.6f}"
+            )
 
-        # Early exit/saving
-        if (epoch + 1) >= warmup:
-            save_model(generator)
-            if np.abs(val_w_dist) < best_val_w_dist:
-                best_val_w_dist = np.abs(val_w_dist)
-                epochs_no_improve = 0
-            else:
-                epochs_no_improve += 1
-                print(f"epochs without w_dist improvement: {epochs_no_improve}")
-                if epochs_no_improve >= patience:
-                    print("Early stopping triggered")
-                    break
+            # Generate example audio
+            if (epoch + 1) % SHOW_GENERATED_INTERVAL == 0:
+                examples_to_generate = 3
+                z = torch.randn(examples_to_generate, LATENT_DIM, 1, 1, device=device)
+                with torch.inference_mode():
+                    generated_audio = generator(z).squeeze().cpu().numpy()
+
+                # Raise errors from the previous round of plots before queuing more
+                for future in plot_futures:
+                    future.result()
+                plot_futures = [
+                    plot_executor.submit(
+                        graph_spectrogram,
+                        generated_audio[i],
+                        f"Epoch {epoch + 1} Generated Audio #{i + 1}",
+                    )
+                    for i in range(examples_to_generate)
+                ]
+
+            # Early exit/saving
+            if (epoch + 1) >= warmup:
+                save_model(generator)
+                if np.abs(val_w_dist) < best_val_w_dist:
+                    best_val_w_dist = np.abs(val_w_dist)
+                    epochs_no_improve = 0
+                else:
+                    epochs_no_improve += 1
+                    print(f"epochs without w_dist improvement: {epochs_no_improve}")
+                    if epochs_no_improve >= patience:
+                        print("Early stopping triggered")
+                        break
+
+        # Surface any plotting errors
+        for future in plot_futures:
+            future.result()